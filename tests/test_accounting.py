@@ -0,0 +1,85 @@
+from unittest import TestCase
+from watttime_client.client import WattTimeAPI
+from watttime_client.accounting import EmissionsAccountant
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+import pytz
+
+
+class TestEmissionsAccountant(TestCase):
+    def setUp(self):
+        # set up client that never hits the API, with hourly data for two BAs
+        self.impacter = WattTimeAPI(token='fake')
+        self.impacter.fetch = self.fail_fetch
+        self.start_at = datetime(2015, 6, 1, tzinfo=pytz.utc)
+        self.end_at = self.start_at + timedelta(hours=3)
+        for hour in range(5):
+            ts = self.start_at + timedelta(hours=hour)
+            self.impacter.insert_to_cache(ts, 'PJM', 'DAHR', 1000. + hour)
+            self.impacter.insert_to_cache(ts, 'CAISO', 'DAHR', 500. + hour)
+        self.accountant = EmissionsAccountant(self.impacter, self.start_at, self.end_at,
+                                              60, market='DAHR')
+        self.calls = 0
+
+    def tearDown(self):
+        self.impacter.cache.clear()
+
+    def fail_fetch(self, *args, **kwargs):
+        raise AssertionError('unexpected fetch')
+
+    def test_totals(self):
+        loads = np.array([[1, 1, 1, 1], [0, 0, 0, 2], [1, 0, 0, 0]])
+        totals = self.accountant.totals(loads, ['PJM', 'CAISO', 'PJM'])
+        self.assertEqual(list(totals), [4006, 1006, 1000])
+
+    def test_totals_dataframe(self):
+        loads = pd.DataFrame([[1, 1, 1, 1], [0, 0, 0, 2]], index=['meter1', 'meter2'])
+        totals = self.accountant.totals(loads, ['CAISO', 'PJM'])
+        self.assertEqual(totals['meter1'], 2006)
+        self.assertEqual(totals['meter2'], 2006)
+
+    def test_impacts_fetched_once_per_ba(self):
+        # count calls to get_impact_between
+        get_impact_between = self.impacter.get_impact_between
+
+        def counting(*args, **kwargs):
+            self.calls += 1
+            return get_impact_between(*args, **kwargs)
+        self.impacter.get_impact_between = counting
+
+        chunks = [(np.ones((10, 4)), ['PJM'] * 5 + ['CAISO'] * 5) for i in range(3)]
+        results = list(self.accountant.totals_chunked(chunks))
+        self.assertEqual(len(results), 3)
+        self.assertEqual(self.calls, 2)
+
+    def test_missing_impacts(self):
+        # no DAHR data before the start
+        self.impacter.fetch = lambda *args: ([], [])
+        early_start = self.start_at - timedelta(hours=2)
+        loads = np.ones((2, 6))
+        accountant = EmissionsAccountant(self.impacter, early_start, self.end_at, 60, market='DAHR')
+        totals = accountant.totals(loads, ['PJM', 'CAISO'])
+        self.assertTrue(np.isnan(totals).all())
+
+        # unless counted as zero
+        accountant = EmissionsAccountant(self.impacter, early_start, self.end_at, 60, market='DAHR',
+                                         missing_as_zero=True)
+        totals = accountant.totals(loads, ['PJM', 'CAISO'])
+        self.assertEqual(list(totals), [4006, 2006])
+
+    def test_missing_inside_range(self):
+        """Gaps inside the range aren't forward filled"""
+        self.impacter.fetch = lambda *args: ([], [])
+        for hour in (0, 3):
+            self.impacter.insert_to_cache(self.start_at + timedelta(hours=hour), 'MISO', 'DAHR', 1000.)
+        loads = np.ones((1, 4))
+        self.assertTrue(np.isnan(self.accountant.totals(loads, ['MISO'])).all())
+
+        accountant = EmissionsAccountant(self.impacter, self.start_at, self.end_at, 60, market='DAHR',
+                                         missing_as_zero=True)
+        self.assertEqual(list(accountant.totals(loads, ['MISO'])), [2000])
+
+    def test_wrong_shape(self):
+        self.assertRaises(ValueError, self.accountant.totals, np.ones((2, 5)), ['PJM', 'PJM'])
+        self.assertRaises(ValueError, self.accountant.totals, np.ones((2, 4)), ['PJM'])
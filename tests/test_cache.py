@@ -0,0 +1,223 @@
+from unittest import TestCase
+from watttime_client.client import WattTimeAPI, LocMemCache
+from watttime_client.cache import SharedMemoryCache, TieredCache
+from watttime_client.serialization import pack_bucket
+from datetime import datetime, timedelta
+import multiprocessing
+import subprocess
+import sys
+import tempfile
+import shutil
+import time
+import os
+import pytz
+
+
+def fill_cache(path, ts):
+    """Inserts a value from another process"""
+    impacter = WattTimeAPI(token='fake', cache=SharedMemoryCache(path))
+    impacter.insert_to_cache(ts, 'PJM', 'RT5M', 1234.)
+
+
+class TestSharedMemoryCache(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'cache')
+        self.cache = SharedMemoryCache(self.path, size=4096)
+        self.ts = datetime(2015, 6, 1, 12, tzinfo=pytz.utc)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_get_set(self):
+        self.assertIsNone(self.cache.get('missing'))
+        self.assertEqual(self.cache.get('missing', b''), b'')
+        self.cache.set('key', b'value')
+        self.assertEqual(self.cache.get('key'), b'value')
+        self.cache.set('key', b'other value')
+        self.assertEqual(self.cache.get('key'), b'other value')
+
+    def test_bytes_only(self):
+        """Nothing is unpickled from the shared file"""
+        self.assertRaises(TypeError, self.cache.set, 'key', {'a': 1})
+
+    def test_bucket_arrays(self):
+        self.cache.set('bucket', pack_bucket([300, 0], [900.5, 800.]))
+
+        # arrays are sorted
+        times, values = self.cache.get_arrays('bucket')
+        self.assertEqual(list(times), [0, 300])
+        self.assertEqual(list(values), [800., 900.5])
+
+        # not a bucket
+        self.cache.set('other', b'junk')
+        self.assertIsNone(self.cache.get_arrays('other'))
+        self.assertIsNone(self.cache.get_arrays('missing'))
+
+    def test_shared_between_instances(self):
+        other = SharedMemoryCache(self.path)
+        self.cache.set('key', b'value')
+        self.assertEqual(other.get('key'), b'value')
+        other.clear()
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_size_set_by_creator(self):
+        """Opening with a different size uses the existing file's size"""
+        other = SharedMemoryCache(self.path, size=64 * 1024 * 1024)
+        self.assertEqual(other.size, 4096)
+        for i in range(200):
+            other.set('key%d' % i, b'x' * 100)
+        self.assertEqual(self.cache.get('key199'), b'x' * 100)
+
+    def test_rejects_unsafe_file(self):
+        os.chmod(self.path, 0o666)
+        self.assertRaises(ValueError, SharedMemoryCache, self.path)
+
+    def test_shared_between_processes(self):
+        process = multiprocessing.Process(target=fill_cache, args=(self.path, self.ts))
+        process.start()
+        process.join()
+        impacter = WattTimeAPI(token='fake', cache=self.cache)
+        self.assertEqual(impacter.best_cached_value(self.ts, 'PJM', 'RT5M'), (self.ts, 1234.))
+
+    def test_compacts_when_full(self):
+        # rewriting one key many times outgrows the file without compaction
+        for i in range(100):
+            self.cache.set('key', b'%d' % i)
+        self.assertEqual(self.cache.get('key'), b'99')
+
+    def test_evicts_oldest(self):
+        for i in range(100):
+            self.cache.set('key%d' % i, b'x' * 100)
+
+        # newest keys kept, oldest dropped
+        self.assertEqual(self.cache.get('key99'), b'x' * 100)
+        self.assertIsNone(self.cache.get('key0'))
+
+        # compaction frees half the file, so it doesn't happen on every set
+        generation = self.cache.generation
+        self.cache.set('key100', b'x' * 100)
+        self.assertEqual(self.cache.generation, generation)
+
+    def test_arrays_survive_compaction(self):
+        self.cache.set('bucket', pack_bucket([0, 300], [900., 901.]))
+        times, values = self.cache.get_arrays('bucket')
+
+        # another instance compacts the file over the bucket
+        other = SharedMemoryCache(self.path)
+        for i in range(100):
+            other.set('key%d' % i, b'x' * 100)
+        self.assertIsNone(self.cache.get_arrays('bucket'))
+        self.assertEqual(list(values), [900., 901.])
+
+    def test_opened_before_fork(self):
+        """Processes forked from one cache still lock each other out"""
+        self.cache = SharedMemoryCache(os.path.join(self.tmpdir, 'big'), size=1024 * 1024)
+        pids = []
+        for child in range(4):
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    for i in range(300):
+                        self.cache.set('%d:%d' % (child, i), b'x')
+                finally:
+                    os._exit(0)
+            pids.append(pid)
+        for pid in pids:
+            os.waitpid(pid, 0)
+        missing = [(child, i) for child in range(4) for i in range(300)
+                   if self.cache.get('%d:%d' % (child, i)) is None]
+        self.assertEqual(missing, [])
+
+    def test_too_big(self):
+        self.cache.set('big', b'x' * 3000)
+        self.assertIsNone(self.cache.get('big'))
+
+    def test_cached_arrays(self):
+        impacter = WattTimeAPI(token='fake', cache=self.cache)
+        times = [self.ts + timedelta(hours=h) for h in range(-14, 14)]
+        impacter.insert_many_to_cache(times, 'PJM', 'RT5M', range(len(times)))
+        seconds, values = impacter.cached_arrays(times[0], times[-1], 'PJM', 'RT5M')
+        self.assertEqual(list(values), list(range(len(times))))
+        self.assertEqual(seconds[1] - seconds[0], 3600)
+
+
+class TestWithoutFcntl(TestCase):
+    def test_client_imports(self):
+        """The client works where fcntl isn't available, like on Windows"""
+        code = ('import sys; sys.modules["fcntl"] = None; '
+                'from watttime_client.client import WattTimeAPI; '
+                'from watttime_client.cache import SharedMemoryCache; '
+                'WattTimeAPI(token="fake")')
+        self.assertEqual(subprocess.call([sys.executable, '-c', code]), 0)
+
+
+class CountingCache(LocMemCache):
+    """Local memory cache that counts reads"""
+    def __init__(self):
+        super(CountingCache, self).__init__()
+        self.reads = 0
+
+    def get(self, key, default=None):
+        self.reads += 1
+        return super(CountingCache, self).get(key, default)
+
+    def delete(self, key):
+        self.pop(key, None)
+
+
+class TestTieredCache(TestCase):
+    def setUp(self):
+        self.backend = CountingCache()
+        self.cache = TieredCache(self.backend, maxsize=2, ttl=60)
+
+    def test_read_through(self):
+        self.backend.set('key', 'value')
+        self.assertEqual(self.cache.get('key'), 'value')
+        self.assertEqual(self.cache.get('key'), 'value')
+        self.assertEqual(self.backend.reads, 1)
+
+    def test_miss_not_cached(self):
+        self.assertEqual(self.cache.get('key', 'default'), 'default')
+        self.backend.set('key', 'value')
+        self.assertEqual(self.cache.get('key'), 'value')
+
+    def test_write_through(self):
+        self.cache.set('key', 'value')
+        self.assertEqual(self.backend['key'], 'value')
+        self.assertEqual(self.cache.get('key'), 'value')
+        self.assertEqual(self.backend.reads, 0)
+
+    def test_ttl(self):
+        self.cache.ttl = 0.01
+        self.cache.set('key', 'value')
+        self.backend.set('key', 'other value')
+        time.sleep(0.02)
+        self.assertEqual(self.cache.get('key'), 'other value')
+
+    def test_bounded(self):
+        for key in ['a', 'b', 'c']:
+            self.cache.set(key, key)
+        self.assertEqual(list(self.cache.local.keys()), ['b', 'c'])
+
+    def test_invalidate_and_delete(self):
+        self.cache.set('key', 'value')
+        self.backend.set('key', 'other value')
+        self.cache.invalidate('key')
+        self.assertEqual(self.cache.get('key'), 'other value')
+        self.cache.delete('key')
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_client_day_served_locally(self):
+        """Repeated lookups in one day read the backend once"""
+        impacter = WattTimeAPI(token='fake', cache=self.cache)
+        ts = datetime(2015, 6, 1, 12, tzinfo=pytz.utc)
+        impacter.insert_to_cache(ts, 'PJM', 'RT5M', 900.)
+        self.backend.reads = 0
+        for minute in range(10):
+            impacter.get_impact_at(ts + timedelta(minutes=minute), 'PJM')
+        self.assertEqual(self.backend.reads, 0)
+
+        # writes read the backend
+        impacter.insert_to_cache(ts, 'PJM', 'RT5M', 901.)
+        self.assertEqual(self.backend.reads, 1)
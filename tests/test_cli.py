@@ -0,0 +1,139 @@
+from unittest import TestCase, mock
+from watttime_client.cli import make_chunks, backfill, Checkpoint, main
+from watttime_client.client import RateLimiter, WattTimeAPI
+from datetime import date, datetime, timedelta
+import tempfile
+import shutil
+import time
+import os
+import pandas as pd
+import pytz
+
+
+class FakeClient(object):
+    """Returns one data point per fetch, failing for BAs in fail"""
+    def __init__(self, fail=(), delay=0):
+        self.fail = fail
+        self.delay = delay
+        self.fetches = []
+
+    def fetch(self, start_at, end_at, ba, market):
+        self.fetches.append((start_at, ba, market))
+        time.sleep(self.delay)
+        if ba in self.fail:
+            raise ValueError('fetch failed')
+        return [start_at], [1000.]
+
+
+class FakeSession(object):
+    """Returns an empty page, recording requests"""
+    def __init__(self):
+        self.requests = []
+
+    def get(self, url, params=None):
+        self.requests.append(url)
+        return FakeResponse()
+
+
+class FakeResponse(object):
+    def json(self):
+        return {'results': [], 'next': None}
+
+
+class TestBackfill(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.checkpoint_path = os.path.join(self.tmpdir, 'checkpoint')
+        self.chunks = make_chunks(['PJM', 'CAISO'], ['RT5M', 'DAHR'],
+                                  date(2015, 6, 1), date(2015, 6, 3))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_make_chunks(self):
+        self.assertEqual(len(self.chunks), 12)
+        chunk_id, ba, market, start_at, end_at = self.chunks[0]
+        self.assertEqual(chunk_id, 'PJM:RT5M:2015-06-01:1d')
+        self.assertEqual(end_at - start_at, timedelta(days=1) - timedelta(seconds=1))
+
+        # multi-day chunks, the last one ending at the end date
+        chunks = make_chunks(['PJM'], ['RT5M'], date(2015, 6, 1), date(2015, 6, 10), chunk_days=7)
+        self.assertEqual([chunk[0] for chunk in chunks],
+                         ['PJM:RT5M:2015-06-01:7d', 'PJM:RT5M:2015-06-08:7d'])
+        self.assertEqual(chunks[-1][4], datetime(2015, 6, 10, 23, 59, 59, tzinfo=pytz.utc))
+
+        # chunks must advance
+        self.assertRaises(ValueError, make_chunks, ['PJM'], ['RT5M'],
+                          date(2015, 6, 1), date(2015, 6, 10), chunk_days=0)
+
+    def test_backfill_writes_files(self):
+        client = FakeClient()
+        n_failed = backfill(client, self.chunks, workers=3, output_dir=self.tmpdir)
+        self.assertEqual(n_failed, 0)
+        self.assertEqual(len(client.fetches), 12)
+        frame = pd.read_csv(os.path.join(self.tmpdir, 'CAISO_DAHR_2015-06-02_1d.csv'))
+        self.assertEqual(list(frame['marginal_carbon']), [1000.])
+
+    def test_resume(self):
+        # first run fails for one BA
+        n_failed = backfill(FakeClient(fail=['CAISO']), self.chunks,
+                            checkpoint=Checkpoint(self.checkpoint_path))
+        self.assertEqual(n_failed, 6)
+
+        # second run only fetches failed chunks
+        client = FakeClient()
+        n_failed = backfill(client, self.chunks, checkpoint=Checkpoint(self.checkpoint_path))
+        self.assertEqual(n_failed, 0)
+        self.assertEqual(set(f[1] for f in client.fetches), set(['CAISO']))
+        self.assertEqual(len(client.fetches), 6)
+
+    def test_interrupt_stops_promptly(self):
+        client = FakeClient(delay=0.05)
+        chunks = make_chunks(['PJM'], ['RT5M'], date(2015, 6, 1), date(2015, 6, 30))
+        with mock.patch('watttime_client.cli.logger.info', side_effect=[None, KeyboardInterrupt]):
+            with self.assertRaises(KeyboardInterrupt):
+                backfill(client, chunks, workers=2)
+
+        # only chunks already started finish
+        self.assertLessEqual(len(client.fetches), 4)
+
+    def test_rate_limit(self):
+        limiter = RateLimiter(50)
+        started = time.time()
+        for i in range(6):
+            limiter.wait()
+        self.assertGreaterEqual(time.time() - started, 0.09)
+
+    def test_rate_limit_per_request(self):
+        client = WattTimeAPI(token='fake', max_requests_per_second=50)
+        client.session = FakeSession()
+        started = time.time()
+        for i in range(3):
+            client.get_page('https://api.watttime.org/api/v1/marginal/')
+        self.assertGreaterEqual(time.time() - started, 0.03)
+        self.assertEqual(len(client.session.requests), 3)
+
+    def test_main_checks_args(self):
+        # no token
+        token = os.environ.pop('WATTTIME_API_TOKEN', None)
+        try:
+            with self.assertRaises(SystemExit):
+                main(['--ba', 'PJM', '--start', '2015-06-01', '--end', '2015-06-02'])
+        finally:
+            if token is not None:
+                os.environ['WATTTIME_API_TOKEN'] = token
+
+        # end before start
+        with self.assertRaises(SystemExit):
+            main(['--ba', 'PJM', '--start', '2015-06-02', '--end', '2015-06-01', '--token', 'fake',
+                  '--output-dir', self.tmpdir])
+
+        # chunks or workers that can't make progress
+        for option in ['--chunk-days', '--workers']:
+            with self.assertRaises(SystemExit):
+                main(['--ba', 'PJM', '--start', '2015-06-01', '--end', '2015-06-02', '--token', 'fake',
+                      '--output-dir', self.tmpdir, option, '0'])
+
+        # nowhere to keep the data
+        with self.assertRaises(SystemExit):
+            main(['--ba', 'PJM', '--start', '2015-06-01', '--end', '2015-06-01', '--token', 'fake'])
@@ -1,7 +1,10 @@
 from unittest import TestCase
-from watttime_client.client import WattTimeAPI
+from watttime_client.client import WattTimeAPI, LocMemCache
 from datetime import datetime, timedelta
+import numpy as np
 import pandas as pd
+import threading
+import time
 import pytz
 import os
 
@@ -205,3 +208,366 @@ class TestAPIClient(TestCase):
         naive_start = self.caiso_start.replace(tzinfo=None)
         self.assertRaises(ValueError, self.impacter.get_impact_between,
                           naive_start, self.caiso_end, interval_minutes=5, ba='CAISO', fill=False)
+
+
+class TestCachedAggregation(TestCase):
+    def setUp(self):
+        # set up client that never hits the API
+        self.impacter = WattTimeAPI(token='fake')
+        self.impacter.fetch = self.fail_fetch
+
+        # fill cache with 5-min data, value 0 at each hour rising by 1
+        self.start_at = datetime(2014, 9, 2, 22, tzinfo=pytz.utc)
+        self.end_at = datetime(2014, 9, 3, 1, tzinfo=pytz.utc)
+        ts = self.start_at - timedelta(hours=1)
+        while ts <= self.end_at + timedelta(hours=2):
+            self.impacter.insert_to_cache(ts, 'PJM', 'RT5M', float(ts.minute // 5))
+            ts += timedelta(minutes=5)
+
+    def tearDown(self):
+        self.impacter.cache.clear()
+
+    def fail_fetch(self, *args, **kwargs):
+        raise AssertionError('unexpected fetch')
+
+    def test_mean(self):
+        series = self.impacter.get_impact_between(self.start_at, self.end_at,
+                                                  interval_minutes=60, ba='PJM',
+                                                  how='mean')
+        self.assertEqual(len(series), 4)
+        for val in series:
+            self.assertAlmostEqual(val, 5.5)
+
+    def test_time_weighted(self):
+        # the first half hour of each interval has values 0 to 5
+        series = self.impacter.get_impact_between(self.start_at, self.end_at,
+                                                  interval_minutes=30, ba='PJM',
+                                                  how='time_weighted')
+        self.assertAlmostEqual(series.iloc[0], 2.5)
+        self.assertAlmostEqual(series.iloc[1], 8.5)
+
+    def test_time_weighted_gap(self):
+        # drop the second half of the first hour
+        for minute in range(30, 60, 5):
+            self.impacter.insert_to_cache(self.start_at.replace(minute=minute), 'PJM', 'RT5M', None)
+        series = self.impacter.get_impact_between(self.start_at, self.start_at,
+                                                  interval_minutes=60, ba='PJM',
+                                                  how='time_weighted')
+        self.assertAlmostEqual(series.iloc[0], 2.5)
+
+    def test_min_max(self):
+        mins = self.impacter.get_impact_between(self.start_at, self.end_at,
+                                                interval_minutes=15, ba='PJM',
+                                                how='min')
+        maxes = self.impacter.get_impact_between(self.start_at, self.end_at,
+                                                 interval_minutes=15, ba='PJM',
+                                                 how='max')
+        self.assertEqual(list(mins.iloc[:4]), [0, 3, 6, 9])
+        self.assertEqual(list(maxes.iloc[:4]), [2, 5, 8, 11])
+
+    def test_matches_point(self):
+        """Mean over one data point is the point value"""
+        point = self.impacter.get_impact_between(self.start_at, self.end_at,
+                                                 interval_minutes=5, ba='PJM')
+        mean = self.impacter.get_impact_between(self.start_at, self.end_at,
+                                                interval_minutes=5, ba='PJM',
+                                                how='mean')
+        self.assertTrue((point == mean).all())
+
+    def test_bad_how(self):
+        self.assertRaises(ValueError, self.impacter.get_impact_between,
+                          self.start_at, self.end_at, interval_minutes=60, ba='PJM',
+                          how='median')
+
+
+class TestGetImpactAtMany(TestCase):
+    def setUp(self):
+        # set up client with fetches recorded and faked
+        self.impacter = WattTimeAPI(token='fake')
+        self.impacter.fetch = self.fake_fetch
+        self.fetches = []
+
+        # fill cache with 5-min data for one hour
+        self.start_at = datetime(2015, 6, 1, 23, 30, tzinfo=pytz.utc)
+        self.times = [self.start_at + timedelta(minutes=5 * i) for i in range(12)]
+        self.impacter.insert_many_to_cache(self.times, 'PJM', 'RT5M',
+                                           [float(i) for i in range(12)])
+
+    def tearDown(self):
+        self.impacter.cache.clear()
+
+    def fake_fetch(self, start_at, end_at, ba, market):
+        """Record fetch and fill range with hourly value -1"""
+        self.fetches.append((start_at, end_at, ba))
+        ts = start_at.replace(minute=0, second=0)
+        times = []
+        while ts <= end_at:
+            times.append(ts)
+            ts += timedelta(hours=1)
+        self.impacter.insert_many_to_cache(times, ba, market, [-1.] * len(times))
+        return times, [-1.] * len(times)
+
+    def test_matches_get_impact_at(self):
+        timestamps = [ts + timedelta(minutes=2) for ts in self.times]
+        values = self.impacter.get_impact_at_many(timestamps, 'PJM')
+        expected = [self.impacter.get_impact_at(ts, 'PJM') for ts in timestamps]
+        self.assertEqual(list(values), expected)
+        self.assertEqual(self.fetches, [])
+
+    def test_across_midnight(self):
+        """Like get_impact_at, cached data from the previous day isn't used"""
+        self.impacter.insert_to_cache(datetime(2015, 6, 2, 23, 55, tzinfo=pytz.utc), 'PJM', 'RT5M', 5.)
+        ts = datetime(2015, 6, 3, 0, 1, tzinfo=pytz.utc)
+        values = self.impacter.get_impact_at_many([ts], 'PJM')
+        self.assertEqual(len(self.fetches), 1)
+        self.assertEqual(list(values), [self.impacter.get_impact_at(ts, 'PJM')])
+
+    def test_stale_fetches_merged(self):
+        late = self.times[-1] + timedelta(hours=2)
+        timestamps = [late, late + timedelta(hours=3), late + timedelta(days=3), self.times[0]]
+        values = self.impacter.get_impact_at_many(timestamps, 'PJM')
+
+        # one fetch for the two close timestamps, one for the far one
+        self.assertEqual(len(self.fetches), 2)
+        self.assertEqual(list(values), [-1., -1., -1., 0.])
+
+    def test_many_bas(self):
+        timestamps = [self.times[0], self.times[0]]
+        values = self.impacter.get_impact_at_many(timestamps, ['PJM', 'CAISO'])
+        self.assertEqual(list(values), [0., -1.])
+        self.assertEqual([f[2] for f in self.fetches], ['CAISO'])
+
+    def test_out_of_range(self):
+        self.impacter.fetch = lambda *args: ([], [])
+        values = self.impacter.get_impact_at_many([datetime(1914, 9, 2, 23)], 'PJM')
+        self.assertTrue(np.isnan(values[0]))
+
+    def test_ba_length(self):
+        self.assertRaises(ValueError, self.impacter.get_impact_at_many,
+                          self.times, ['PJM'])
+
+
+class TestStaleWhileRevalidate(TestCase):
+    def setUp(self):
+        # set up client with slow fake fetches
+        self.impacter = WattTimeAPI(token='fake', stale_grace=timedelta(minutes=10))
+        self.impacter.fetch = self.fake_fetch
+        self.fetches = []
+        self.release = threading.Event()
+
+        # cache one value
+        self.cached_at = datetime(2015, 6, 1, 12, tzinfo=pytz.utc)
+        self.impacter.insert_to_cache(self.cached_at, 'PJM', 'RT5M', 900.)
+
+    def tearDown(self):
+        self.release.set()
+        self.impacter.cache.clear()
+
+    def fake_fetch(self, start_at, end_at, ba, market):
+        """Wait for release, then cache a new value"""
+        self.fetches.append(start_at)
+        self.release.wait(5)
+        ts = start_at + self.impacter.FETCH_WINDOW
+        self.impacter.insert_to_cache(ts, ba, market, 1000.)
+        return [ts], [1000.]
+
+    def test_fresh(self):
+        value = self.impacter.get_impact_at(self.cached_at + timedelta(minutes=10), 'PJM')
+        self.assertEqual(value, 900.)
+        self.assertEqual(self.fetches, [])
+
+    def test_within_grace(self):
+        # stale values return right away, with one refresh
+        ts = self.cached_at + timedelta(minutes=20)
+        self.assertEqual(self.impacter.get_impact_at(ts, 'PJM'), 900.)
+        self.assertEqual(self.impacter.get_impact_at(ts, 'PJM'), 900.)
+        self.assertEqual(len(self.fetches), 1)
+
+        # refreshed value is used once the refresh finishes
+        self.release.set()
+        for i in range(100):
+            if not self.impacter.refreshing:
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.impacter.get_impact_at(ts, 'PJM'), 1000.)
+
+    def test_refreshes_each_window(self):
+        """Stale lookups far apart in one day each get a refresh"""
+        self.impacter.insert_to_cache(self.cached_at.replace(hour=0, minute=40), 'PJM', 'RT5M', 800.)
+        self.assertEqual(self.impacter.get_impact_at(self.cached_at.replace(hour=1), 'PJM'), 800.)
+        self.assertEqual(self.impacter.get_impact_at(self.cached_at.replace(minute=20), 'PJM'), 900.)
+        self.assertEqual(self.impacter.get_impact_at(self.cached_at.replace(minute=21), 'PJM'), 900.)
+        self.assertEqual(len(self.fetches), 2)
+
+    def test_many_within_grace(self):
+        timestamps = [self.cached_at + timedelta(minutes=20), self.cached_at + timedelta(minutes=21)]
+        values = self.impacter.get_impact_at_many(timestamps, 'PJM')
+        self.assertEqual(list(values), [900., 900.])
+        self.assertEqual(len(self.fetches), 1)
+
+        # single lookups share the refresh
+        self.assertEqual(self.impacter.get_impact_at(timestamps[0], 'PJM'), 900.)
+        self.assertEqual(len(self.fetches), 1)
+
+    def test_many_past_grace(self):
+        self.release.set()
+        values = self.impacter.get_impact_at_many([self.cached_at + timedelta(minutes=30)], 'PJM')
+        self.assertEqual(list(values), [1000.])
+
+    def test_past_grace(self):
+        # blocks on fetch
+        self.release.set()
+        ts = self.cached_at + timedelta(minutes=30)
+        self.assertEqual(self.impacter.get_impact_at(ts, 'PJM'), 1000.)
+        self.assertEqual(self.impacter.refreshing, set())
+
+    def test_concurrent_inserts(self):
+        """A refresh and a blocking fetch writing the same day keep both points"""
+        cache = self.impacter.cache
+        get = cache.get
+
+        def slow_get(key, default=None):
+            value = get(key, default)
+            time.sleep(0.05)
+            return value
+        cache.get = slow_get
+
+        times = [self.cached_at + timedelta(hours=h) for h in (1, 2)]
+        threads = [threading.Thread(target=self.impacter.insert_many_to_cache,
+                                    args=([ts], 'PJM', 'RT5M', [1000.])) for ts in times]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        del cache.get
+        cached = self.impacter.get_from_cache(self.cached_at, 'PJM', 'RT5M')
+        self.assertEqual(sorted(cached), [self.cached_at] + times)
+
+    def test_off_by_default(self):
+        self.release.set()
+        self.impacter.stale_grace = None
+        ts = self.cached_at + timedelta(minutes=20)
+        self.assertEqual(self.impacter.get_impact_at(ts, 'PJM'), 1000.)
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, data=None, headers=None):
+        self.status_code = status_code
+        self.data = data
+        self.headers = headers or {}
+
+    def json(self):
+        return self.data
+
+
+class FakeSession(object):
+    """Serves two pages of data, honoring If-None-Match"""
+    def __init__(self):
+        self.requests = []
+        self.pages = {
+            'https://api.watttime.org/api/v1/marginal/': {
+                'results': [{'timestamp': '2015-06-01T12:00:00Z', 'marginal_carbon': {'value': 900.}}],
+                'next': 'https://api.watttime.org/api/v1/marginal/?page=2',
+            },
+            'https://api.watttime.org/api/v1/marginal/?page=2': {
+                'results': [{'timestamp': '2015-06-01T12:05:00Z', 'marginal_carbon': {'value': 901.}}],
+                'next': None,
+            },
+        }
+
+    def get(self, url, params=None, headers=None):
+        self.requests.append((url, headers))
+        etag = '"%s"' % url
+        if headers and headers.get('If-None-Match') == etag:
+            return FakeResponse(304)
+        return FakeResponse(200, self.pages[url], {'ETag': etag})
+
+
+class TestConditionalRequests(TestCase):
+    def setUp(self):
+        self.impacter = WattTimeAPI(token='fake', response_store=LocMemCache())
+        self.impacter.session = FakeSession()
+        self.start_at = datetime(2015, 6, 1, 12, tzinfo=pytz.utc)
+        self.end_at = datetime(2015, 6, 1, 13, tzinfo=pytz.utc)
+
+    def tearDown(self):
+        self.impacter.cache.clear()
+
+    def test_accepts_compression(self):
+        session = WattTimeAPI(token='fake').session
+        self.assertIn('gzip', session.headers['Accept-Encoding'])
+        self.assertEqual(session.headers['Authorization'], 'Token fake')
+
+    def test_conditional_refetch(self):
+        times, values = self.impacter.fetch(self.start_at, self.end_at, 'PJM', 'RT5M')
+        self.assertEqual(values, [900., 901.])
+        first_headers = [headers for url, headers in self.impacter.session.requests]
+        self.assertEqual(first_headers, [{}, {}])
+
+        # cold cache, same request
+        self.impacter.cache.clear()
+        times_again, values_again = self.impacter.fetch(self.start_at, self.end_at, 'PJM', 'RT5M')
+        self.assertEqual((times_again, values_again), (times, values))
+        second_headers = [headers for url, headers in self.impacter.session.requests[2:]]
+        self.assertEqual([h['If-None-Match'] for h in second_headers],
+                         ['"https://api.watttime.org/api/v1/marginal/"',
+                          '"https://api.watttime.org/api/v1/marginal/?page=2"'])
+
+        # stored pages weren't modified by fetch
+        page = self.impacter.session.pages['https://api.watttime.org/api/v1/marginal/']
+        self.assertEqual(len(page['results']), 1)
+
+    def test_store_off_by_default(self):
+        self.impacter.response_store = None
+        self.impacter.fetch(self.start_at, self.end_at, 'PJM', 'RT5M')
+        self.impacter.fetch(self.start_at, self.end_at, 'PJM', 'RT5M')
+        self.assertEqual(len(self.impacter.session.requests), 4)
+
+    def test_response_key_normalized(self):
+        key1 = self.impacter.response_key('https://a.org/x/?b=2', {'a': '1'})
+        key2 = self.impacter.response_key('https://a.org/x/?a=1&b=2')
+        key3 = self.impacter.response_key('https://a.org/x/?a=1&b=3')
+        self.assertEqual(key1, key2)
+        self.assertNotEqual(key1, key3)
+
+
+class TestCoveringArrays(TestCase):
+    def setUp(self):
+        # set up client with fetches recorded and faked
+        self.impacter = WattTimeAPI(token='fake')
+        self.impacter.fetch = self.fake_fetch
+        self.fetches = []
+
+        # cache 5-min data at the start and end of the day only
+        self.day = datetime(2015, 6, 1, tzinfo=pytz.utc)
+        times = [self.day + timedelta(minutes=5 * i) for i in range(13)]
+        times += [self.day + timedelta(hours=23, minutes=5 * i) for i in range(13)]
+        self.impacter.insert_many_to_cache(times, 'PJM', 'RT5M', [1.] * len(times))
+
+    def tearDown(self):
+        self.impacter.cache.clear()
+
+    def fake_fetch(self, start_at, end_at, ba, market):
+        """Record fetch and fill range with 5-min value 2"""
+        self.fetches.append((start_at, end_at))
+        times = []
+        ts = start_at
+        while ts <= end_at:
+            times.append(ts)
+            ts += timedelta(minutes=5)
+        self.impacter.insert_many_to_cache(times, ba, market, [2.] * len(times))
+        return times, [2.] * len(times)
+
+    def test_fetches_hole(self):
+        series = self.impacter.get_impact_between(self.day, self.day + timedelta(hours=23),
+                                                  60, 'PJM', how='mean', fill=False)
+        self.assertEqual(self.fetches, [(self.day + timedelta(hours=1),
+                                         self.day + timedelta(hours=23))])
+        self.assertFalse(series.isnull().any())
+        self.assertEqual(series.iloc[0], 1.)
+        self.assertEqual(series.iloc[12], 2.)
+
+    def test_covered(self):
+        self.impacter.get_impact_between(self.day, self.day + timedelta(minutes=45),
+                                         15, 'PJM', how='mean')
+        self.assertEqual(self.fetches, [])
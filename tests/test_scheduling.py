@@ -0,0 +1,90 @@
+from unittest import TestCase
+from watttime_client.scheduling import best_start_times, schedule_jobs
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+import pytz
+
+
+class TestScheduling(TestCase):
+    def setUp(self):
+        # set up a day of 5-min impacts
+        self.start_at = datetime(2015, 6, 1, tzinfo=pytz.utc)
+        dtidx = pd.date_range(self.start_at, periods=288, freq='5Min')
+        rng = np.random.RandomState(0)
+        self.series = pd.Series(rng.uniform(500, 1500, len(dtidx)), index=dtidx)
+
+    def brute_force(self, n_intervals, first=0, last=None):
+        """Mean impact for every start position, the slow way"""
+        if last is None:
+            last = len(self.series) - n_intervals
+        return dict((self.series.index[i], self.series.iloc[i:i + n_intervals].mean())
+                    for i in range(first, last + 1))
+
+    def test_best_start(self):
+        best = best_start_times(self.series, 60)
+        expected = self.brute_force(12)
+        best_ts = min(expected, key=expected.get)
+        self.assertEqual(len(best), 1)
+        self.assertEqual(best.index[0], best_ts)
+        self.assertAlmostEqual(best.iloc[0], expected[best_ts])
+
+    def test_top_k_sorted(self):
+        best = best_start_times(self.series, 30, k=5)
+        expected = sorted(self.brute_force(6).values())[:5]
+        self.assertEqual(len(best), 5)
+        for got, want in zip(best, expected):
+            self.assertAlmostEqual(got, want)
+
+    def test_deadline_and_earliest(self):
+        earliest = self.start_at + timedelta(hours=2)
+        deadline = self.start_at + timedelta(hours=6)
+        best = best_start_times(self.series, 60, deadline=deadline, earliest=earliest, k=100)
+
+        # every start in range, job finishes by deadline
+        self.assertEqual(len(best), 37)
+        self.assertGreaterEqual(best.index.min(), earliest)
+        self.assertLessEqual(best.index.max() + timedelta(hours=1), deadline)
+
+    def test_mixed_timezones(self):
+        earliest = self.start_at + timedelta(hours=2)
+        deadline = self.start_at + timedelta(hours=6)
+        expected = best_start_times(self.series, 60, deadline=deadline, earliest=earliest, k=100)
+
+        # naive times against an aware index
+        best = best_start_times(self.series, 60, deadline=deadline.replace(tzinfo=None),
+                                earliest=earliest.replace(tzinfo=None), k=100)
+        self.assertEqual(list(best.index), list(expected.index))
+
+        # aware times in another zone against a naive UTC index
+        eastern = pytz.timezone('US/Eastern')
+        naive_series = self.series.tz_localize(None)
+        best = best_start_times(naive_series, 60, deadline=deadline.astimezone(eastern),
+                                earliest=earliest.astimezone(eastern), k=100)
+        self.assertEqual(list(best.index), list(expected.index.tz_localize(None)))
+
+    def test_infeasible(self):
+        deadline = self.start_at + timedelta(minutes=30)
+        best = best_start_times(self.series, 60, deadline=deadline)
+        self.assertEqual(len(best), 0)
+
+    def test_skips_missing(self):
+        self.series.iloc[10] = np.nan
+        best = best_start_times(self.series, 60, k=300)
+        # windows starting at positions 0 to 10 include the gap
+        self.assertEqual(len(best), 288 - 12 + 1 - 11)
+        self.assertTrue(np.isfinite(best).all())
+
+    def test_batch(self):
+        durations = [15, 60, 15, 120]
+        deadlines = [None, self.start_at + timedelta(hours=3), None, None]
+        jobs = schedule_jobs(self.series, durations, deadlines, k=2)
+
+        # each job matches the single-job result
+        for job, (duration, deadline) in enumerate(zip(durations, deadlines)):
+            single = best_start_times(self.series, duration, deadline=deadline, k=2)
+            self.assertEqual(list(jobs.loc[job, 'start']), list(single.index))
+            self.assertEqual(list(jobs.loc[job, 'impact']), list(single))
+
+    def test_batch_lengths_must_match(self):
+        self.assertRaises(ValueError, schedule_jobs, self.series, [15, 30], [None])
@@ -0,0 +1,89 @@
+from unittest import TestCase
+from watttime_client.client import WattTimeAPI
+from watttime_client.serialization import (pack_bucket, unpack_bucket, encode_bucket,
+                                           decode_bucket, bucket_arrays)
+from datetime import datetime, timedelta
+import pickle
+import numpy as np
+import pytz
+
+
+class TestSerialization(TestCase):
+    def setUp(self):
+        # a day of 5-min data
+        self.start_at = datetime(2015, 6, 1, tzinfo=pytz.utc)
+        self.bucket = dict((self.start_at + timedelta(minutes=5 * i), 900. + i)
+                           for i in range(288))
+
+    def test_roundtrip(self):
+        for float32 in (False, True):
+            for compress in (False, True):
+                encoded = encode_bucket(self.bucket, float32=float32, compress=compress)
+                self.assertEqual(decode_bucket(encoded), self.bucket)
+
+    def test_smaller_than_pickle(self):
+        encoded = encode_bucket(self.bucket)
+        self.assertLess(len(encoded) * 2, len(pickle.dumps(self.bucket, pickle.HIGHEST_PROTOCOL)))
+        self.assertLess(len(encode_bucket(self.bucket, float32=True)), len(encoded))
+        self.assertLess(len(encode_bucket(self.bucket, compress=True)), len(encoded))
+
+    def test_naive_as_utc(self):
+        naive = datetime(2015, 6, 1, 12)
+        decoded = decode_bucket(encode_bucket({naive: 900.}))
+        self.assertEqual(decoded, {pytz.utc.localize(naive): 900.})
+
+        # mixed with aware times in the client
+        impacter = WattTimeAPI(token='fake')
+        impacter.insert_to_cache(naive, 'PJM', 'RT5M', 900.)
+        impacter.insert_to_cache(self.start_at, 'PJM', 'RT5M', 800.)
+        self.assertEqual(impacter.best_cached_value(pytz.utc.localize(naive), 'PJM', 'RT5M'),
+                         (pytz.utc.localize(naive), 900.))
+
+    def test_none_values(self):
+        self.bucket[self.start_at] = None
+        decoded = decode_bucket(encode_bucket(self.bucket))
+        self.assertIsNone(decoded[self.start_at])
+
+    def test_empty(self):
+        self.assertEqual(decode_bucket(encode_bucket({})), {})
+        times, values = unpack_bucket(pack_bucket([], []))
+        self.assertEqual(len(times), 0)
+
+    def test_sorted_arrays(self):
+        times, values = unpack_bucket(pack_bucket([600, 0, 300], [3., 1., 2.]))
+        self.assertEqual(list(times), [0, 300, 600])
+        self.assertEqual(list(values), [1., 2., 3.])
+
+    def test_legacy_dict(self):
+        """Version 0 buckets are plain dicts"""
+        self.assertIs(decode_bucket(self.bucket), self.bucket)
+        times, values = bucket_arrays(self.bucket)
+        self.assertEqual(values[0], 900.)
+        self.assertEqual(times[1] - times[0], 300)
+
+    def test_unreadable(self):
+        self.assertIsNone(bucket_arrays(None))
+        self.assertIsNone(bucket_arrays(b'XX junk'))
+        self.assertEqual(decode_bucket(b'XX junk'), {})
+
+    def test_client_migrates_legacy(self):
+        impacter = WattTimeAPI(token='fake')
+        key = impacter.cache_key(self.start_at, 'PJM', 'RT5M')
+        impacter.cache.set(key, dict(self.bucket))
+
+        # legacy bucket is readable
+        best = impacter.best_cached_value(self.start_at + timedelta(minutes=7), 'PJM', 'RT5M')
+        self.assertEqual(best, (self.start_at + timedelta(minutes=5), 901.))
+
+        # and rewritten in the new format on insert
+        impacter.insert_to_cache(self.start_at, 'PJM', 'RT5M', -1.)
+        self.assertIsInstance(impacter.cache[key], bytes)
+        self.assertEqual(len(impacter.get_from_cache(self.start_at, 'PJM', 'RT5M')), 288)
+
+    def test_client_float32_compressed(self):
+        impacter = WattTimeAPI(token='fake', cache_float32=True, cache_compress=True)
+        impacter.insert_to_cache(self.start_at, 'PJM', 'RT5M', 900.1)
+        best_time, best_value = impacter.best_cached_value(self.start_at, 'PJM', 'RT5M')
+        self.assertEqual(best_time, self.start_at)
+        self.assertAlmostEqual(best_value, 900.1, places=3)
+        self.assertTrue(np.isscalar(best_value))
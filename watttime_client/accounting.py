@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class EmissionsAccountant(object):
+    def __init__(self, client, start_ts, end_ts, interval_minutes,
+                 market='RT5M', how='point', missing_as_zero=False):
+        """
+        Compute emissions for many load profiles over one time range,
+        using impacts from a WattTimeAPI client.
+        Load profiles have one column per interval from start_ts to end_ts,
+        in MWh, so totals are in lb.
+        The how argument is passed on to get_impact_between.
+        Missing impacts are not forward filled, anywhere in the range:
+        totals for devices in a BA with missing impacts are NaN,
+        unless missing_as_zero is set to count missing impacts as zero.
+        """
+        self.client = client
+        self.start_ts = start_ts
+        self.end_ts = end_ts
+        self.interval_minutes = interval_minutes
+        self.market = market
+        self.how = how
+        self.missing_as_zero = missing_as_zero
+
+        # impact vectors, fetched once per BA
+        self.impacts = {}
+
+    def impact_vector(self, ba):
+        """
+        Returns a numpy array of the impact for each interval in the BA,
+        with NaN (or zero if missing_as_zero) for missing impacts.
+        """
+        if ba not in self.impacts:
+            series = self.client.get_impact_between(self.start_ts, self.end_ts,
+                                                    self.interval_minutes, ba,
+                                                    market=self.market, how=self.how,
+                                                    fill=False)
+            vector = series.values.astype(float)
+            n_missing = np.isnan(vector).sum()
+            if n_missing and self.missing_as_zero:
+                logger.warning('Missing %d of %d impact values for %s, counting them as zero' %
+                               (n_missing, len(vector), ba))
+                vector = np.nan_to_num(vector)
+            elif n_missing:
+                logger.warning('Missing %d of %d impact values for %s, totals will be NaN' %
+                               (n_missing, len(vector), ba))
+            self.impacts[ba] = vector
+        return self.impacts[ba]
+
+    def totals(self, loads, bas):
+        """
+        Get total emissions for each load profile.
+        loads is a devices x intervals array or dataframe,
+        and bas gives the BA of each device.
+        Returns a numpy array, or a pandas series with the same index
+        if loads is a dataframe.
+        """
+        index = loads.index if isinstance(loads, pd.DataFrame) else None
+        loads = np.asarray(loads, dtype=float)
+        bas = np.asarray(bas)
+        if loads.ndim != 2 or len(bas) != loads.shape[0]:
+            raise ValueError('loads must be 2-dimensional with one BA per row')
+
+        # one matrix-vector product per BA
+        totals = np.zeros(loads.shape[0])
+        unique_bas, ba_rows = np.unique(bas, return_inverse=True)
+        for i, ba in enumerate(unique_bas):
+            vector = self.impact_vector(ba)
+            if len(vector) != loads.shape[1]:
+                raise ValueError('loads have %d intervals but %s has %d impact values' %
+                                 (loads.shape[1], ba, len(vector)))
+            rows = ba_rows == i
+            totals[rows] = loads[rows].dot(vector)
+
+        # return
+        if index is not None:
+            return pd.Series(totals, index=index)
+        return totals
+
+    def totals_chunked(self, chunks):
+        """
+        Get total emissions for an iterable of (loads, bas) chunks,
+        yielding the totals for each chunk in turn.
+        Only one chunk is held in memory at a time,
+        and impacts are shared between chunks.
+        """
+        for loads, bas in chunks:
+            yield self.totals(loads, bas)
@@ -0,0 +1,290 @@
+from collections import OrderedDict
+import threading
+import logging
+import struct
+import time
+import mmap
+import zlib
+import os
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+from watttime_client.serialization import unpack_bucket
+
+
+logger = logging.getLogger(__name__)
+
+
+class SharedMemoryCache(object):
+    """
+    Cache of bytes values shared between processes
+    through a memory-mapped file, with Django compatibility.
+
+    Values are appended to the file as records, and the newest record
+    for a key wins, so get_arrays can read packed day buckets straight from
+    the file without decoding. Writers take an exclusive file lock and readers
+    a shared one. When the file fills up, the newest records are compacted
+    to the front and the oldest are dropped.
+    A cache opened before a fork reopens the file in the child on first use.
+
+    The file must belong to the current user and not be writable by others.
+    Only available on POSIX systems.
+    Its size is set by whichever process creates it.
+    """
+    MAGIC = b'WTCACHE2'
+    HEADER = struct.Struct('<8sQQQ')  # magic, generation, end of records, file size
+    RECORD = struct.Struct('<II')  # key length, payload length
+
+    def __init__(self, path, size=64 * 1024 * 1024):
+        if fcntl is None:
+            raise RuntimeError('SharedMemoryCache requires a POSIX system')
+        self.path = path
+        self.open(size)
+
+    def open(self, size):
+        """
+        Opens and maps the file, setting it up at the given size if new.
+        Called again after a fork, since a descriptor shared with the parent
+        would share its file lock too.
+        """
+        self.pid = os.getpid()
+        self.lock = threading.RLock()
+
+        # open file, refusing links and files others could have written
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT | getattr(os, 'O_NOFOLLOW', 0), 0o600)
+        stat = os.fstat(self.fd)
+        if stat.st_uid != os.getuid() or stat.st_mode & 0o022:
+            os.close(self.fd)
+            raise ValueError('Shared cache file %s must be owned by the current user '
+                             'and not writable by others' % self.path)
+
+        # use size in header, or set it up if new
+        with self.locked():
+            self.size = 0
+            header = os.pread(self.fd, self.HEADER.size, 0)
+            if len(header) == self.HEADER.size and header[:len(self.MAGIC)] == self.MAGIC:
+                size = self.HEADER.unpack(header)[3]
+                self.map(size)
+            else:
+                os.ftruncate(self.fd, size)
+                self.map(size)
+                self.HEADER.pack_into(self.mm, 0, self.MAGIC, 0, self.HEADER.size, size)
+
+        # per-process index of record locations
+        self.index = {}
+        self.generation = None
+        self.synced = self.HEADER.size
+
+    def map(self, size):
+        """Maps the file at the given size"""
+        if size != self.size:
+            self.mm = mmap.mmap(self.fd, size)
+            self.size = size
+
+    def locked(self, shared=False):
+        """Context manager holding both the process and file locks"""
+        if os.getpid() != self.pid:
+            os.close(self.fd)
+            self.open(self.size)
+        return _FileLock(self.lock, self.fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+
+    def sync(self):
+        """Index any records appended by other processes"""
+        magic, generation, end, size = self.HEADER.unpack_from(self.mm, 0)
+        self.map(size)
+        if generation != self.generation:
+            self.index = {}
+            self.generation = generation
+            self.synced = self.HEADER.size
+        offset = self.synced
+        while offset < end:
+            key_len, payload_len = self.RECORD.unpack_from(self.mm, offset)
+            key_offset = offset + self.RECORD.size
+            key = self.mm[key_offset:key_offset + key_len].decode('utf-8')
+            payload_offset = _align(key_offset + key_len)
+            self.index[key] = (offset, payload_offset, payload_len)
+            offset = _align(payload_offset + payload_len)
+        self.synced = offset
+
+    def get(self, key, default=None):
+        with self.locked(shared=True):
+            self.sync()
+            if key not in self.index:
+                return default
+            record_offset, offset, length = self.index[key]
+            return self.mm[offset:offset + length]
+
+    def get_arrays(self, key):
+        """
+        Returns numpy arrays of epoch seconds and values
+        for a packed day bucket, or None if the key isn't one.
+        The arrays are copied out while the lock is held,
+        so a later compaction can't change them.
+        """
+        with self.locked(shared=True):
+            self.sync()
+            if key not in self.index:
+                return None
+            record_offset, offset, length = self.index[key]
+            try:
+                times, values = unpack_bucket(memoryview(self.mm)[offset:offset + length].toreadonly())
+                return times, values.copy()
+            except (ValueError, struct.error, zlib.error):
+                return None
+
+    def set(self, key, value):
+        if not isinstance(value, bytes):
+            raise TypeError('SharedMemoryCache only stores bytes values')
+
+        # values too big for half the file would force a compaction every time
+        if self.record_size(key.encode('utf-8'), value) > (self.size - self.HEADER.size) // 2:
+            logger.warning('Value for %s is too big for shared cache %s, not caching it' %
+                           (key, self.path))
+            return
+
+        with self.locked():
+            self.sync()
+            if not self.append(key, value):
+                self.compact()
+                self.append(key, value)
+
+    def record_size(self, key_bytes, payload):
+        return _align(_align(self.RECORD.size + len(key_bytes)) + len(payload))
+
+    def append(self, key, payload):
+        """Appends a record, returning False if there is no room. Call with the lock held."""
+        key_bytes = key.encode('utf-8')
+        offset = self.synced
+        key_offset = offset + self.RECORD.size
+        payload_offset = _align(key_offset + len(key_bytes))
+        end = offset + self.record_size(key_bytes, payload)
+        if end > self.size:
+            return False
+
+        # write record, then publish it by moving the end
+        self.RECORD.pack_into(self.mm, offset, len(key_bytes), len(payload))
+        self.mm[key_offset:key_offset + len(key_bytes)] = key_bytes
+        self.mm[payload_offset:payload_offset + len(payload)] = payload
+        self.HEADER.pack_into(self.mm, 0, self.MAGIC, self.generation, end, self.size)
+        self.sync()
+        return True
+
+    def compact(self):
+        """
+        Rewrites the newest record for each key, dropping the oldest ones
+        so that at most half the file is used. Call with the lock held.
+        """
+        # newest records first, until half full
+        budget = (self.size - self.HEADER.size) // 2
+        live = []
+        for key, (record_offset, offset, length) in sorted(self.index.items(),
+                                                           key=lambda item: -item[1][0]):
+            payload = self.mm[offset:offset + length]
+            budget -= self.record_size(key.encode('utf-8'), payload)
+            if budget < 0:
+                break
+            live.append((key, payload))
+        logger.debug('Compacting shared cache %s, dropping %d of %d keys' %
+                     (self.path, len(self.index) - len(live), len(self.index)))
+
+        # rewrite in the original order
+        self.reset()
+        for key, payload in reversed(live):
+            self.append(key, payload)
+
+    def reset(self):
+        """Drops all records. Call with the lock held."""
+        self.HEADER.pack_into(self.mm, 0, self.MAGIC, self.generation + 1,
+                              self.HEADER.size, self.size)
+        self.sync()
+
+    def clear(self):
+        with self.locked():
+            self.sync()
+            self.reset()
+
+
+class TieredCache(object):
+    """
+    Bounded in-process cache in front of another cache backend,
+    with Django compatibility.
+
+    Reads are served locally for up to ttl seconds after they were
+    last read from or written to the backend, keeping at most maxsize
+    of the most recently used keys. Writes go to both.
+    Writes from other processes may not be seen locally until ttl expires;
+    call invalidate before a read that must see them.
+    """
+    def __init__(self, backend, maxsize=1024, ttl=5):
+        self.backend = backend
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.local = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        # local hit
+        with self.lock:
+            entry = self.local.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires > time.time():
+                    self.local.move_to_end(key)
+                    return value
+                del self.local[key]
+
+        # local miss, promote from backend
+        value = self.backend.get(key, _MISSING)
+        if value is _MISSING:
+            return default
+        self.store(key, value)
+        return value
+
+    def set(self, key, value):
+        self.backend.set(key, value)
+        self.store(key, value)
+
+    def store(self, key, value):
+        with self.lock:
+            self.local[key] = (time.time() + self.ttl, value)
+            self.local.move_to_end(key)
+            while len(self.local) > self.maxsize:
+                self.local.popitem(last=False)
+
+    def invalidate(self, key):
+        """Drops a key locally, so the next get reads the backend"""
+        with self.lock:
+            self.local.pop(key, None)
+
+    def delete(self, key):
+        self.backend.delete(key)
+        self.invalidate(key)
+
+    def clear(self):
+        self.backend.clear()
+        with self.lock:
+            self.local.clear()
+
+
+_MISSING = object()
+
+
+class _FileLock(object):
+    def __init__(self, lock, fd, operation):
+        self.lock = lock
+        self.fd = fd
+        self.operation = operation
+
+    def __enter__(self):
+        self.lock.acquire()
+        fcntl.flock(self.fd, self.operation)
+
+    def __exit__(self, *exc_info):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        self.lock.release()
+
+
+def _align(offset):
+    """Rounds up to a multiple of 8 bytes"""
+    return (offset + 7) & ~7
@@ -0,0 +1,196 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timedelta
+import itertools
+import threading
+import argparse
+import logging
+import time
+import sys
+import os
+import pandas as pd
+import pytz
+from watttime_client.client import WattTimeAPI
+
+
+logger = logging.getLogger(__name__)
+
+
+class Checkpoint(object):
+    """Records completed chunks, one per line, so a backfill can resume"""
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.completed = set()
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.completed = set(line.strip() for line in f if line.strip())
+
+    def done(self, chunk_id):
+        with self.lock:
+            self.completed.add(chunk_id)
+            if self.path:
+                with open(self.path, 'a') as f:
+                    f.write(chunk_id + '\n')
+
+
+def make_chunks(bas, markets, start_date, end_date, chunk_days=1):
+    """
+    Returns a list of (chunk id, ba, market, start, end) tuples
+    covering every BA and market from start_date to end_date inclusive.
+    Chunk ids include the chunk length, so chunks of different lengths
+    never match each other in a checkpoint.
+    """
+    if chunk_days < 1:
+        raise ValueError('chunk_days must be at least 1')
+    end_day = datetime(end_date.year, end_date.month, end_date.day)
+    last_at = pytz.utc.localize(end_day + timedelta(days=1, seconds=-1))
+    chunks = []
+    for ba in bas:
+        for market in markets:
+            day = start_date
+            while day <= end_date:
+                start_at = pytz.utc.localize(datetime(day.year, day.month, day.day))
+                end_at = min(start_at + timedelta(days=chunk_days, seconds=-1), last_at)
+                chunk_id = '%s:%s:%s:%dd' % (ba.upper(), market.upper(), day.isoformat(), chunk_days)
+                chunks.append((chunk_id, ba, market, start_at, end_at))
+                day += timedelta(days=chunk_days)
+    return chunks
+
+
+def backfill(client, chunks, workers=4, output_dir=None,
+             output_format='csv', checkpoint=None):
+    """
+    Fetches every chunk that isn't already in the checkpoint,
+    which fills the client's cache, and writes each to a file
+    in output_dir if given.
+    Returns the number of chunks that failed.
+    """
+    if workers < 1:
+        raise ValueError('workers must be at least 1')
+    checkpoint = checkpoint or Checkpoint()
+    todo = [chunk for chunk in chunks if chunk[0] not in checkpoint.completed]
+    logger.info('Backfilling %d chunks, skipping %d already done' %
+                (len(todo), len(chunks) - len(todo)))
+
+    def run(chunk):
+        chunk_id, ba, market, start_at, end_at = chunk
+        times, values = client.fetch(start_at, end_at, ba, market)
+        if output_dir:
+            write_chunk(output_dir, output_format, chunk_id, times, values)
+        checkpoint.done(chunk_id)
+        return len(times)
+
+    # run chunks in pool, reporting progress as they finish;
+    # only a few chunks per worker are queued, so an interrupt stops promptly
+    n_done, n_failed, n_points = 0, 0, 0
+    started = time.time()
+    pending = iter(todo)
+    running = {}
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        for chunk in itertools.islice(pending, 2 * workers):
+            running[executor.submit(run, chunk)] = chunk[0]
+        while running:
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                chunk_id = running.pop(future)
+                try:
+                    n_points += future.result()
+                    n_done += 1
+                except Exception:
+                    logger.exception('Failed to backfill %s' % chunk_id)
+                    n_failed += 1
+                elapsed = max(time.time() - started, 1e-6)
+                logger.info('%d/%d chunks done, %d failed, %.2f chunks/s, %.0f points/s' %
+                            (n_done, len(todo), n_failed, n_done / elapsed, n_points / elapsed))
+                for chunk in itertools.islice(pending, 1):
+                    running[executor.submit(run, chunk)] = chunk[0]
+    finally:
+        for future in running:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+    # return
+    return n_failed
+
+
+def write_chunk(output_dir, output_format, chunk_id, times, values):
+    """Writes the data for one chunk to a CSV or Parquet file"""
+    frame = pd.DataFrame({'timestamp': times, 'marginal_carbon': values})
+    path = os.path.join(output_dir, '%s.%s' % (chunk_id.replace(':', '_'), output_format))
+    if output_format == 'parquet':
+        frame.to_parquet(path, index=False)
+    else:
+        frame.to_csv(path, index=False)
+
+
+def parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Backfill WattTime marginal carbon data into the cache or to files.')
+    parser.add_argument('--token', default=os.environ.get('WATTTIME_API_TOKEN'),
+                        help='API token (default: $WATTTIME_API_TOKEN)')
+    parser.add_argument('--ba', nargs='+', required=True, help='balancing authorities')
+    parser.add_argument('--market', nargs='+', default=['RT5M'], help='markets (default: RT5M)')
+    parser.add_argument('--start', type=parse_date, required=True, help='first date, YYYY-MM-DD')
+    parser.add_argument('--end', type=parse_date, required=True, help='last date, YYYY-MM-DD')
+    parser.add_argument('--chunk-days', type=int, default=1, help='days per request (default: 1)')
+    parser.add_argument('--workers', type=int, default=4, help='parallel requests (default: 4)')
+    parser.add_argument('--rate-limit', type=float, default=None,
+                        help='maximum API requests per second (default: unlimited)')
+    parser.add_argument('--output-dir', help='write one file per chunk to this directory')
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='csv',
+                        help='output file format (default: csv)')
+    parser.add_argument('--checkpoint', help='file of completed chunks, to resume from')
+    parser.add_argument('--cache-path', help='fill a SharedMemoryCache at this path')
+    parser.add_argument('-v', '--verbose', action='store_true', help='log debug output')
+    return parser
+
+
+def main(argv=None):
+    parser = get_parser()
+    args = parser.parse_args(argv)
+    if args.token is None:
+        parser.error('an API token is required, with --token or $WATTTIME_API_TOKEN')
+    if args.end < args.start:
+        parser.error('--end must not be before --start')
+    if args.chunk_days < 1:
+        parser.error('--chunk-days must be at least 1')
+    if args.workers < 1:
+        parser.error('--workers must be at least 1')
+    if not args.output_dir and not args.cache_path:
+        parser.error('nothing would be kept; give --output-dir, --cache-path, or both')
+    if args.format == 'parquet' and args.output_dir:
+        try:
+            import pyarrow  # noqa
+        except ImportError:
+            parser.error('writing parquet requires pyarrow')
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format='%(asctime)s %(levelname)s %(message)s')
+
+    # set up client
+    cache = None
+    if args.cache_path:
+        from watttime_client.cache import SharedMemoryCache
+        cache = SharedMemoryCache(args.cache_path)
+    client = WattTimeAPI(token=args.token, cache=cache, max_requests_per_second=args.rate_limit)
+    if args.output_dir and not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    # backfill
+    chunks = make_chunks(args.ba, args.market, args.start, args.end, args.chunk_days)
+    n_failed = backfill(client, chunks, workers=args.workers,
+                        output_dir=args.output_dir, output_format=args.format,
+                        checkpoint=Checkpoint(args.checkpoint))
+    if n_failed:
+        logger.error('%d chunks failed; rerun with the same --checkpoint to retry them' % n_failed)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
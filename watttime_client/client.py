@@ -1,8 +1,16 @@
 import requests
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+import numpy as np
 import pandas as pd
+from calendar import timegm
 from datetime import datetime, timedelta
 import pytz
 import logging
+import hashlib
+import threading
+import time
+from watttime_client.serialization import encode_bucket, decode_bucket, bucket_arrays
+from watttime_client.cache import TieredCache
 
 
 logger = logging.getLogger(__name__)
@@ -14,22 +22,77 @@ class LocMemCache(dict):
         self[key] = value
 
 
+class RateLimiter(object):
+    """Spaces out calls across threads to at most rate per second"""
+    def __init__(self, rate):
+        self.interval = 1. / rate if rate else 0.
+        self.lock = threading.Lock()
+        self.next_call = time.time()
+
+    def wait(self):
+        with self.lock:
+            now = time.time()
+            delay = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
 class WattTimeAPI(object):
-    def __init__(self, token=None):
-        """Require API token"""
+    AGGREGATIONS = ('point', 'mean', 'time_weighted', 'min', 'max')
+    FETCH_WINDOW = timedelta(hours=4)
+
+    def __init__(self, token=None, cache=None, cache_float32=False, cache_compress=False,
+                 local_cache_ttl=5, stale_grace=None, response_store=None,
+                 max_requests_per_second=None):
+        """
+        Require API token.
+        Optionally takes a cache backend, such as a SharedMemoryCache;
+        by default uses the Django default cache if available,
+        with reads kept in local memory for local_cache_ttl seconds
+        (set to 0 to turn this off).
+        Cached values can be stored as float32 and compressed
+        to save space in the cache.
+        If stale_grace is a timedelta, get_impact_at returns cached values
+        up to that much older than usual while refreshing them in the background.
+        If response_store is a cache, API responses are kept in it
+        so that unchanged pages aren't downloaded again.
+        API requests can be limited to max_requests_per_second,
+        shared by all threads using the client.
+        """
         # set token in header
         if token is None:
             raise ValueError('WattTime API token required')
         self.auth_header = {'Authorization': 'Token %s' % token}
 
-        # set up cache
-        try:
-            from django.core.cache import caches
-            self.cache = caches['default']
-            logger.debug('Using Django default cache for WattTime API client.')
-        except ImportError:
-            self.cache = LocMemCache()
-            logger.warn('Django cache unavailable to WattTime API client, falling back to local memory cache.')
+        # set up http session, asking for compressed responses
+        self.session = requests.Session()
+        self.session.headers.update(self.auth_header)
+        self.session.headers['Accept-Encoding'] = self.accept_encoding()
+        self.response_store = response_store
+        self.rate_limiter = RateLimiter(max_requests_per_second)
+
+        # set up background refreshes
+        self.stale_grace = stale_grace
+        self.refreshing = set()
+        self.refresh_lock = threading.Lock()
+
+        # set up cache, with day buckets updated by one thread at a time
+        self.cache_lock = threading.Lock()
+        self.cache_float32 = cache_float32
+        self.cache_compress = cache_compress
+        if cache is not None:
+            self.cache = cache
+        else:
+            try:
+                from django.core.cache import caches
+                self.cache = caches['default']
+                logger.debug('Using Django default cache for WattTime API client.')
+                if local_cache_ttl:
+                    self.cache = TieredCache(self.cache, ttl=local_cache_ttl)
+            except ImportError:
+                self.cache = LocMemCache()
+                logger.warn('Django cache unavailable to WattTime API client, falling back to local memory cache.')
 
     def fetch(self, start_at, end_at, ba, market, **kwargs):
         """
@@ -46,14 +109,13 @@ class WattTimeAPI(object):
         params.update(kwargs)
 
         # make request
-        result = requests.get('https://api.watttime.org/api/v1/marginal/',
-                              params=params, headers=self.auth_header)
-        data = result.json()['results']
+        page = self.get_page('https://api.watttime.org/api/v1/marginal/', params)
+        data = list(page['results'])
 
         n_pages = 1
-        while result.json()['next']:
-            result = requests.get(result.json()['next'], headers=self.auth_header)
-            data += result.json()['results']
+        while page['next']:
+            page = self.get_page(page['next'])
+            data += page['results']
             n_pages += 1
         logger.debug('Made %d requests and got %d datapoints for params %s' % (n_pages, len(data), params))
 
@@ -66,13 +128,70 @@ class WattTimeAPI(object):
         ret_times, ret_values = [], []
         for d, v in zip(times, values):
             if v is not None:
-                self.insert_to_cache(d, ba, market, v)
                 ret_times.append(d)
                 ret_values.append(v)
+        self.insert_many_to_cache(ret_times, ba, market, ret_values)
 
         # return
         return ret_times, ret_values
 
+    def get_page(self, url, params=None):
+        """
+        Gets one page of JSON from the API.
+        If there is a response store and the page was seen before,
+        asks the API to send it only if it changed,
+        and otherwise returns the stored copy.
+        """
+        self.rate_limiter.wait()
+        if self.response_store is None:
+            return self.session.get(url, params=params).json()
+
+        # look up stored response
+        key = self.response_key(url, params)
+        stored = self.response_store.get(key)
+        headers = {}
+        if stored:
+            if stored['etag']:
+                headers['If-None-Match'] = stored['etag']
+            if stored['last_modified']:
+                headers['If-Modified-Since'] = stored['last_modified']
+
+        # make request
+        response = self.session.get(url, params=params, headers=headers)
+        if response.status_code == 304 and stored:
+            logger.debug('Using stored response for unchanged %s' % url)
+            return stored['data']
+        data = response.json()
+
+        # store response if it can be validated later
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if etag or last_modified:
+            self.response_store.set(key, {'etag': etag, 'last_modified': last_modified,
+                                          'data': data})
+
+        # return
+        return data
+
+    def response_key(self, url, params=None):
+        """Returns a store key for a request, independent of parameter order"""
+        scheme, netloc, path, query, fragment = urlsplit(url)
+        query_params = parse_qsl(query) + sorted((params or {}).items())
+        normalized = urlunsplit((scheme, netloc, path, urlencode(sorted(query_params)), ''))
+        return 'watttime:response:' + hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+    def accept_encoding(self):
+        """Returns the compressed encodings requests can decode here"""
+        encodings = ['gzip', 'deflate']
+        for module in ('brotli', 'brotlicffi'):
+            try:
+                __import__(module)
+                encodings.append('br')
+                break
+            except ImportError:
+                pass
+        return ', '.join(encodings)
+
     def get_impact_at(self, ts, ba, market='RT5M'):
         """
         Get marginal carbon impact for the given timestamp and BA,
@@ -84,15 +203,16 @@ class WattTimeAPI(object):
         # if got good data, return
         if best_cached_time:
             lag_time = ts - best_cached_time
-            if lag_time < timedelta(hours=1) and market == 'DAHR':
-                # acceptable lag is 1 hr for hourly data
+            if lag_time < self.max_lag(market):
                 return best_cached_value
-            elif lag_time < timedelta(minutes=15):
-                # acceptable lag is 15 min otherwise
+
+            # if got slightly stale data, return it and refresh in the background
+            if self.stale_grace and lag_time < self.max_lag(market) + self.stale_grace:
+                self.refresh_in_background(ts, ba, market)
                 return best_cached_value
 
         # if got here, no good data in cache, so fetch it
-        times, values = self.fetch(ts - timedelta(hours=4), ts + timedelta(hours=4), ba, market)
+        times, values = self.fetch(ts - self.FETCH_WINDOW, ts + self.FETCH_WINDOW, ba, market)
 
         # best value is latest time before or equal to ts
         best_value = None
@@ -104,14 +224,108 @@ class WattTimeAPI(object):
         # return
         return best_value
 
+    def refresh_in_background(self, ts, ba, market, end_ts=None):
+        """
+        Fetches data around the timestamp (or from ts to end_ts)
+        in a background thread, unless a refresh already in progress covers it.
+        """
+        end_ts = end_ts or ts
+        with self.refresh_lock:
+            for refreshing_ba, refreshing_market, start_at, end_at in self.refreshing:
+                if (refreshing_ba, refreshing_market) == (ba, market) and start_at <= ts and end_ts <= end_at:
+                    return
+            key = (ba, market, ts - self.FETCH_WINDOW, end_ts + self.FETCH_WINDOW)
+            self.refreshing.add(key)
+
+        def refresh():
+            try:
+                self.fetch(key[2], key[3], ba, market)
+            except Exception:
+                logger.exception('Background refresh failed for %s %s from %s to %s' % key)
+            finally:
+                with self.refresh_lock:
+                    self.refreshing.discard(key)
+
+        thread = threading.Thread(target=refresh)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def get_impact_at_many(self, timestamps, ba, market='RT5M'):
+        """
+        Get marginal carbon impacts for an array of timestamps,
+        using the RT5M market by default.
+        ba is either one BA for all timestamps or an array with one BA per timestamp.
+        Naive timestamps are treated as UTC.
+        Returns a numpy array of impacts in the same order, with NaN for missing data.
+        Uses stale_grace the same way as get_impact_at.
+        """
+        # utcify
+        seconds = datetime_to_seconds(pd.DatetimeIndex(pd.to_datetime(timestamps, utc=True)))
+        if isinstance(ba, str):
+            bas = np.full(len(seconds), ba, dtype=object)
+        else:
+            bas = np.asarray(ba, dtype=object)
+            if len(bas) != len(seconds):
+                raise ValueError('ba must be a string or have one BA per timestamp')
+
+        impacts = np.full(len(seconds), np.nan)
+        lag_s = self.max_lag(market).total_seconds()
+        window_s = self.FETCH_WINDOW.total_seconds()
+        for one_ba in set(bas.tolist()):
+            positions = np.flatnonzero(bas == one_ba)
+            ba_seconds = seconds[positions]
+
+            # like get_impact_at, look for cached data in each timestamp's own UTC day
+            days = np.unique(ba_seconds // 86400)
+            times, values = self.cached_arrays_for_days(days, one_ba, market)
+            found, best = asof_search(times, values, ba_seconds, lag_s, same_day=True)
+
+            # return slightly stale values, refreshing them in the background
+            if self.stale_grace and not found.all():
+                grace_s = lag_s + self.stale_grace.total_seconds()
+                graced, grace_best = asof_search(times, values, ba_seconds, grace_s, same_day=True)
+                graced &= ~found
+                for first, last in merge_ranges(np.sort(ba_seconds[graced]), 2 * window_s):
+                    self.refresh_in_background(datetime.fromtimestamp(first, pytz.utc), one_ba, market,
+                                               end_ts=datetime.fromtimestamp(last, pytz.utc))
+                best[graced] = grace_best[graced]
+                found |= graced
+
+            # fetch stale ranges, merging any that overlap
+            stale = np.sort(ba_seconds[~found])
+            if len(stale):
+                for first, last in merge_ranges(stale, 2 * window_s):
+                    self.fetch(datetime.fromtimestamp(first - window_s, pytz.utc),
+                               datetime.fromtimestamp(last + window_s, pytz.utc),
+                               one_ba, market)
+
+                # like get_impact_at, accept anything in the fetch window once fetched
+                times, values = self.cached_arrays_for_days(np.union1d(days, days - 1),
+                                                            one_ba, market)
+                refetched, rebest = asof_search(times, values, ba_seconds[~found], window_s)
+                best[~found] = np.where(refetched, rebest, np.nan)
+
+            impacts[positions] = best
+
+        # return
+        return impacts
+
     def get_impact_between(self, start_ts, end_ts, interval_minutes, ba,
-                           market='RT5M', fill=True):
+                           market='RT5M', fill=True, how='point'):
         """
         Get a pandas series of the marginal carbon impact
         for the given time range, interval length, and BA,
         using the RT5M market by default.
         By default, forward fills missing data; turn this off with fill=False.
+
+        By default each value is the impact at its timestamp (how='point').
+        Pass how='mean', 'time_weighted', 'min' or 'max' to instead aggregate
+        all data in the interval starting at each timestamp.
         """
+        if how not in self.AGGREGATIONS:
+            raise ValueError('how must be one of %s' % ', '.join(self.AGGREGATIONS))
+
         # utcify
         try:  # aware
             utc_start = start_ts.astimezone(pytz.utc)
@@ -126,11 +340,20 @@ class WattTimeAPI(object):
         # set up datetime index with correct interval
         dtidx = pd.date_range(utc_start, utc_end, freq='%dMin' % interval_minutes)
 
-        # get cached value for every timestamp
-        values = dtidx.map(lambda ts: self.get_impact_at(ts, ba, market))
+        if how == 'point' or not len(dtidx):
+            # get cached value for every timestamp
+            values = dtidx.map(lambda ts: self.get_impact_at(ts, ba, market))
+        else:
+            # aggregate cached data over every interval
+            interval = timedelta(minutes=interval_minutes)
+            times, impacts = self.covering_arrays(utc_start, utc_end + interval, ba, market)
+            edges = np.append(datetime_to_seconds(dtidx),
+                              datetime_to_seconds(dtidx[-1:] + interval))
+            values = aggregate_intervals(times, impacts, edges, how,
+                                         self.max_lag(market).total_seconds())
 
         # set up series
-        series = pd.Series(values, index=dtidx)
+        series = pd.Series(values, index=dtidx, dtype=float)
 
         # fill any remaining null values
         if fill:
@@ -139,6 +362,18 @@ class WattTimeAPI(object):
         # return
         return series
 
+    def max_lag(self, market):
+        """
+        Returns the oldest a data point can be
+        and still be used as the impact at a later time.
+        """
+        if market == 'DAHR':
+            # acceptable lag is 1 hr for hourly data
+            return timedelta(hours=1)
+        else:
+            # acceptable lag is 15 min otherwise
+            return timedelta(minutes=15)
+
     def get_timestamp(self, d):
         """Extracts an aware UTC datetime from a data dict"""
         naive_dt = datetime.strptime(d['timestamp'], '%Y-%m-%dT%H:%M:%SZ')
@@ -156,47 +391,254 @@ class WattTimeAPI(object):
         return ba.upper() + ":" + market.upper() + ":" + ts.strftime('%Y-%m-%d')
 
     def insert_to_cache(self, ts, ba, market, value):
-        # query cache
-        cached_data = self.get_from_cache(ts, ba, market)
+        with self.cache_lock:
+            # query cache
+            cached_data = self.get_from_cache(ts, ba, market, fresh=True)
 
-        # update value
-        cached_data.update({ts: value})
+            # update value
+            cached_data.update({ts: value})
 
-        # set cache
-        self.cache.set(self.cache_key(ts, ba, market), cached_data)
+            # set cache
+            self.set_in_cache(ts, ba, market, cached_data)
 
-    def get_from_cache(self, ts, ba, market):
+    def insert_many_to_cache(self, times, ba, market, values):
+        """Inserts time/value pairs, setting each day in the cache once"""
+        # group by day
+        days = {}
+        for d, v in zip(times, values):
+            days.setdefault(self.cache_key(d, ba, market), (d, {}))[1][d] = v
+
+        # update each day
+        with self.cache_lock:
+            for ts, new_data in days.values():
+                cached_data = self.get_from_cache(ts, ba, market, fresh=True)
+                cached_data.update(new_data)
+                self.set_in_cache(ts, ba, market, cached_data)
+
+    def set_in_cache(self, ts, ba, market, cached_data):
+        """Encodes a dict of time/value pairs and sets it in the cache"""
+        encoded = encode_bucket(cached_data, float32=self.cache_float32,
+                                compress=self.cache_compress)
+        self.cache.set(self.cache_key(ts, ba, market), encoded)
+
+    def get_from_cache(self, ts, ba, market, fresh=False):
+        """
+        Returns a dict of cached time/value pairs for the day.
+        If fresh, bypasses any local copy of a shared cache.
+        """
         # query cache
         cache_key = self.cache_key(ts, ba, market)
-        cached_data = self.cache.get(cache_key, {})
+        if fresh and hasattr(self.cache, 'invalidate'):
+            self.cache.invalidate(cache_key)
+        cached_data = decode_bucket(self.cache.get(cache_key))
 
         # return
         return cached_data
 
+    def get_arrays_from_cache(self, ts, ba, market):
+        """
+        Returns numpy arrays of epoch seconds and values in the cache,
+        or None if nothing is cached.
+        """
+        # query cache, using arrays directly if the cache stores them
+        cache_key = self.cache_key(ts, ba, market)
+        arrays = None
+        if hasattr(self.cache, 'get_arrays'):
+            arrays = self.cache.get_arrays(cache_key)
+        if arrays is None:
+            arrays = bucket_arrays(self.cache.get(cache_key))
+
+        # return
+        return arrays
+
     def best_cached_value(self, ts, ba, market):
         """
         Returns the best cached time/value pair for the arguments,
         or (None, None) if no good value found in cache.
         """
         # query cache
-        cached_data = self.get_from_cache(ts, ba, market)
+        times, values = self.cached_arrays(ts, ts, ba, market)
+
+        # best value is latest time before or equal to ts
+        i = np.searchsorted(times, timegm(ts.utctimetuple()), side='right') - 1
 
-        # if no cache, no best value
-        if not cached_data:
+        # if none, no best value
+        if i < 0:
             return (None, None)
 
-        # sort times and values
-        times = sorted(cached_data.keys())
-        values = [cached_data[d] for d in times]
+        # return
+        best_time = datetime.fromtimestamp(times[i], pytz.utc)
+        best_value = None if np.isnan(values[i]) else float(values[i])
+        return best_time, best_value
 
-        # best value is latest time before or equal to ts
-        best_time, best_value = None, None
-        for d, v in zip(times, values):
-            if d <= ts:
-                best_time = d
-                best_value = v
-            else:
-                break
+    def cached_arrays(self, start_ts, end_ts, ba, market):
+        """
+        Returns sorted numpy arrays of epoch seconds and impact values
+        for every cached data point in the days spanned by start_ts and end_ts.
+        Missing values are NaN.
+        """
+        # days in range
+        days = []
+        day = start_ts.replace(hour=0, minute=0, second=0, microsecond=0)
+        while day <= end_ts:
+            days.append(day)
+            day += timedelta(days=1)
+
+        # gather all day buckets in range
+        return self.cached_arrays_for_days(days, ba, market)
+
+    def cached_arrays_for_days(self, days, ba, market):
+        """
+        Like cached_arrays, for a sorted list of datetimes or UTC day numbers
+        (days since the epoch).
+        """
+        days = [datetime.fromtimestamp(day * 86400, pytz.utc) if np.isscalar(day) else day
+                for day in days]
+        arrays = [self.get_arrays_from_cache(day, ba, market) for day in days]
+        arrays = [a for a in arrays if a is not None]
+        if not arrays:
+            return np.array([]), np.array([])
+        seconds = np.concatenate([t for t, v in arrays]).astype(float)
+        values = np.concatenate([v for t, v in arrays]).astype(float)
+        return seconds, values
+
+    def covering_arrays(self, start_ts, end_ts, ba, market):
+        """
+        Like cached_arrays, but first fetches any parts of the range
+        from start_ts to end_ts without fresh enough data in the cache.
+        Also includes cached data up to max_lag before start_ts.
+        """
+        lag = self.max_lag(market)
+        times, values = self.cached_arrays(start_ts - lag, end_ts, ba, market)
+
+        # fetch any parts of the range the cache doesn't cover
+        start_s, end_s = timegm(start_ts.utctimetuple()), timegm(end_ts.utctimetuple())
+        gaps = uncovered_ranges(times, start_s, end_s, lag.total_seconds(),
+                                self.FETCH_WINDOW.total_seconds())
+        for gap_start, gap_end in gaps:
+            self.fetch(datetime.fromtimestamp(gap_start, pytz.utc),
+                       datetime.fromtimestamp(gap_end, pytz.utc), ba, market)
 
         # return
-        return best_time, best_value
+        if gaps:
+            return self.cached_arrays(start_ts - lag, end_ts, ba, market)
+        return times, values
+
+
+def datetime_to_seconds(dtidx):
+    """Converts an aware DatetimeIndex to a numpy array of epoch seconds"""
+    epoch = pd.Timestamp('1970-01-01', tz=pytz.utc)
+    return np.asarray((dtidx - epoch).total_seconds(), dtype=float)
+
+
+def uncovered_ranges(times, start, end, max_lag, merge_within):
+    """
+    Returns a list of (start, end) epoch second ranges between start and end
+    where no data point is less than max_lag seconds old,
+    each starting at the data point before it if there is one.
+    Ranges less than merge_within seconds apart are merged.
+    """
+    # data points that can cover the range, with the end as a sentinel
+    before = times[times <= start]
+    inside = times[(times > start) & (times < end)]
+    points = np.concatenate([before[-1:] if len(before) else [-np.inf], inside, [end]])
+
+    # gaps between consecutive points
+    i = np.flatnonzero(np.diff(points) > max_lag)
+    gap_starts = np.maximum(points[i], start)
+    gap_ends = points[i + 1]
+
+    # merge close gaps
+    ranges = []
+    for gap_start, gap_end in zip(gap_starts.tolist(), gap_ends.tolist()):
+        if ranges and gap_start - ranges[-1][1] < merge_within:
+            ranges[-1] = (ranges[-1][0], gap_end)
+        else:
+            ranges.append((gap_start, gap_end))
+    return ranges
+
+
+def merge_ranges(seconds, max_gap):
+    """
+    Splits sorted epoch seconds wherever consecutive ones are more than
+    max_gap apart, returning a list of (first, last) pairs.
+    """
+    if not len(seconds):
+        return []
+    breaks = np.flatnonzero(np.diff(seconds) > max_gap)
+    return list(zip(np.append(seconds[0], seconds[breaks + 1]).tolist(),
+                    np.append(seconds[breaks], seconds[-1]).tolist()))
+
+
+def asof_search(times, values, seconds, max_lag, same_day=False):
+    """
+    Finds the latest value at or before each of an array of epoch seconds,
+    if it is less than max_lag seconds old
+    (and, if same_day, in the same UTC day).
+    Returns a boolean array of whether a data point was found,
+    and an array of values (NaN where not found).
+    """
+    i = np.searchsorted(times, seconds, side='right') - 1
+    found = i >= 0
+    i[~found] = 0
+    if len(times):
+        found &= seconds - times[i] < max_lag
+        if same_day:
+            found &= times[i] // 86400 == seconds // 86400
+        return found, np.where(found, values[i], np.nan)
+    return found, np.full(len(seconds), np.nan)
+
+
+def aggregate_intervals(times, values, edges, how, max_lag):
+    """
+    Aggregates impact values over the intervals between consecutive edges,
+    in one vectorized pass over sorted arrays of epoch seconds.
+
+    'mean', 'min' and 'max' use the data points inside each interval.
+    'time_weighted' holds each value until the next data point,
+    or for at most max_lag seconds, and averages over the time covered.
+    Intervals without usable data are NaN.
+    """
+    valid = ~np.isnan(values)
+    filled = np.where(valid, values, 0.)
+
+    if how == 'time_weighted':
+        # duration each value holds for
+        held = np.minimum(np.append(np.diff(times), max_lag), max_lag)
+
+        # cumulative integral and covered time at each data point
+        integral = np.append(0., np.cumsum(filled * held))
+        covered = np.append(0., np.cumsum(valid * held))
+
+        # evaluate both at each edge, including the partial segment
+        i = np.searchsorted(times, edges, side='right') - 1
+        before = i < 0
+        i[before] = 0
+        if len(times):
+            partial = np.minimum(edges - times[i], held[i])
+            edge_integral = np.where(before, 0., integral[i] + filled[i] * partial)
+            edge_covered = np.where(before, 0., covered[i] + valid[i] * partial)
+        else:
+            edge_integral = edge_covered = np.zeros(len(edges))
+
+        numerator = np.diff(edge_integral)
+        denominator = np.diff(edge_covered)
+    else:
+        # index range of data points in each interval
+        lo = np.searchsorted(times, edges[:-1], side='left')
+        hi = np.searchsorted(times, edges[1:], side='left')
+        counts = np.append(0, np.cumsum(valid))
+        denominator = counts[hi] - counts[lo]
+
+        if how == 'mean':
+            sums = np.append(0., np.cumsum(filled))
+            numerator = sums[hi] - sums[lo]
+        else:
+            # edges are contiguous, so reduce over each data point range at once
+            reducer = np.fmin if how == 'min' else np.fmax
+            padded = np.append(values, np.nan)
+            numerator = reducer.reduceat(padded, np.append(lo, hi[-1:]))[:-1]
+            denominator = np.where(denominator > 0, 1., 0.)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(denominator > 0, numerator / denominator, np.nan)
@@ -0,0 +1,116 @@
+import numpy as np
+import pandas as pd
+import pytz
+
+
+def best_start_times(series, duration_minutes, deadline=None, earliest=None, k=1):
+    """
+    Get the k start times with the lowest marginal carbon impact
+    for a job of the given duration, using an impact series
+    from WattTimeAPI.get_impact_between.
+    Only start times at or after earliest that let the job finish
+    by deadline are considered.
+    Returns a pandas series of the mean impact over each job window,
+    indexed by start time and sorted from lowest to highest.
+    """
+    jobs = schedule_jobs(series, [duration_minutes], [deadline], [earliest], k=k)
+    if not len(jobs):
+        return pd.Series([], index=series.index[:0], dtype=float, name='impact')
+    return jobs.loc[0].set_index('start')['impact']
+
+
+def schedule_jobs(series, durations_minutes, deadlines=None, earliests=None, k=1):
+    """
+    Get the k lowest-impact start times for each of many jobs,
+    sharing one impact series from WattTimeAPI.get_impact_between.
+    durations_minutes is a list of job lengths;
+    deadlines and earliests are optional lists of the same length,
+    with None meaning unconstrained.
+    Returns a pandas dataframe indexed by job number and rank
+    with columns 'start' and 'impact' (mean impact over the job window).
+    Jobs with no feasible start time have no rows.
+    """
+    n_jobs = len(durations_minutes)
+    if deadlines is None:
+        deadlines = [None] * n_jobs
+    if earliests is None:
+        earliests = [None] * n_jobs
+    if len(deadlines) != n_jobs or len(earliests) != n_jobs:
+        raise ValueError('durations_minutes, deadlines and earliests must have the same length')
+
+    index = series.index
+    interval = interval_of(series)
+    values = np.asarray(series, dtype=float)
+
+    # cumulative sums shared by all window lengths
+    valid = ~np.isnan(values)
+    sums = np.append(0., np.cumsum(np.where(valid, values, 0.)))
+    n_missing = np.append(0, np.cumsum(~valid))
+
+    window_means = {}
+    rows, job_index = [], []
+    for job, (duration, deadline, earliest) in enumerate(zip(durations_minutes, deadlines, earliests)):
+        # length in intervals, rounding up partial intervals
+        n_intervals = max(int(np.ceil(pd.Timedelta(minutes=duration) / interval)), 1)
+        if n_intervals > len(values):
+            continue
+
+        # mean impact of every window of this length, computed once per length
+        if n_intervals not in window_means:
+            window_sums = sums[n_intervals:] - sums[:-n_intervals]
+            incomplete = (n_missing[n_intervals:] - n_missing[:-n_intervals]) > 0
+            window_means[n_intervals] = np.where(incomplete, np.inf,
+                                                 window_sums / n_intervals)
+        means = window_means[n_intervals]
+
+        # range of feasible start positions
+        first = 0
+        if earliest is not None:
+            first = index.searchsorted(align_timestamp(earliest, index), side='left')
+        last = len(means) - 1
+        if deadline is not None:
+            latest_start = align_timestamp(deadline, index) - n_intervals * interval
+            last = min(last, index.searchsorted(latest_start, side='right') - 1)
+        if last < first:
+            continue
+
+        # k smallest window means in range, in order
+        candidates = means[first:last + 1]
+        if k < len(candidates):
+            best = np.argpartition(candidates, k - 1)[:k]
+        else:
+            best = np.arange(len(candidates))
+        best = best[np.argsort(candidates[best], kind='stable')]
+        best = best[np.isfinite(candidates[best])]
+
+        for rank, position in enumerate(best):
+            rows.append((index[first + position], candidates[position]))
+            job_index.append((job, rank))
+
+    return pd.DataFrame(rows, columns=['start', 'impact'],
+                        index=pd.MultiIndex.from_tuples(job_index, names=['job', 'rank'])
+                        if job_index else None)
+
+
+def interval_of(series):
+    """Returns the regular spacing of a series index as a pandas Timedelta"""
+    if series.index.freq is not None:
+        return pd.Timedelta(series.index.freq)
+    if len(series) < 2:
+        raise ValueError('series must have a regular frequency')
+    return series.index[1] - series.index[0]
+
+
+def align_timestamp(ts, index):
+    """
+    Returns ts as a pandas Timestamp comparable to the index,
+    treating naive times and naive indexes as UTC.
+    """
+    ts = pd.Timestamp(ts)
+    if index.tz is not None:
+        if ts.tz is None:
+            ts = ts.tz_localize(pytz.utc)
+        return ts.tz_convert(index.tz)
+    if ts.tz is not None:
+        ts = ts.tz_convert(pytz.utc).tz_localize(None)
+    return ts
@@ -0,0 +1,120 @@
+"""
+Compact encoding of cached day buckets.
+
+Version 0 buckets are dicts of aware datetime to value, as stored by
+earlier versions of the client. Version 1 buckets are bytes: a header,
+then int32 offsets in seconds from a base epoch time and float64 or
+float32 values, optionally zlib compressed. NaN values stand for None.
+"""
+from calendar import timegm
+from datetime import datetime
+import logging
+import struct
+import zlib
+import numpy as np
+import pytz
+
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'WT'
+VERSION = 1
+HEADER = struct.Struct('<2sBBIq')  # magic, version, flags, count, base epoch seconds
+FLOAT32 = 1
+COMPRESSED = 2
+
+
+def pack_bucket(seconds, values, float32=False, compress=False):
+    """
+    Encodes arrays of epoch seconds and values as version 1 bytes.
+    Times must span less than 68 years.
+    """
+    seconds = np.asarray(seconds, dtype=np.int64)
+    values = np.asarray(values, dtype=float)
+
+    # sort by time
+    order = np.argsort(seconds, kind='stable')
+    seconds, values = seconds[order], values[order]
+
+    # offsets from first time
+    base = int(seconds[0]) if len(seconds) else 0
+    offsets = seconds - base
+    if len(offsets) and offsets[-1] > np.iinfo(np.int32).max:
+        raise ValueError('times span too long to pack')
+
+    # body
+    flags = 0
+    if float32:
+        flags |= FLOAT32
+    body = b''.join([offsets.astype('<i4').tobytes(),
+                     values.astype('<f4' if float32 else '<f8').tobytes()])
+    if compress:
+        flags |= COMPRESSED
+        body = zlib.compress(body)
+
+    return HEADER.pack(MAGIC, VERSION, flags, len(seconds), base) + body
+
+
+def unpack_bucket(blob):
+    """
+    Decodes version 1 bytes into arrays of epoch seconds and float64 values.
+    Uncompressed float64 values are a read-only view of the blob.
+    """
+    magic, version, flags, count, base = HEADER.unpack_from(blob, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('unsupported cache bucket version')
+
+    # body
+    body = blob[HEADER.size:]
+    if flags & COMPRESSED:
+        body = zlib.decompress(body)
+    offsets = np.frombuffer(body, dtype='<i4', count=count)
+    values = np.frombuffer(body, dtype='<f4' if flags & FLOAT32 else '<f8',
+                           count=count, offset=4 * count)
+
+    # return
+    return base + offsets.astype(np.int64), values.astype(float, copy=False)
+
+
+def encode_bucket(data, float32=False, compress=False):
+    """
+    Encodes a dict of datetime to value as version 1 bytes.
+    Naive datetimes are treated as UTC.
+    """
+    times = list(data.keys())
+    seconds = [timegm(d.utctimetuple()) for d in times]
+    values = [data[d] for d in times]
+    return pack_bucket(seconds, np.array(values, dtype=float), float32=float32, compress=compress)
+
+
+def bucket_arrays(value):
+    """
+    Returns arrays of epoch seconds and values for a cached bucket
+    of any version, or None if there is no usable bucket.
+    """
+    if value is None:
+        return None
+
+    # version 0
+    if isinstance(value, dict):
+        times = sorted(value.keys())
+        seconds = np.array([timegm(d.utctimetuple()) for d in times], dtype=np.int64)
+        return seconds, np.array([value[d] for d in times], dtype=float)
+
+    # version 1
+    try:
+        return unpack_bucket(value)
+    except (ValueError, struct.error, zlib.error):
+        logger.warning('Ignoring unreadable cache bucket')
+        return None
+
+
+def decode_bucket(value):
+    """Returns a dict of aware datetime to value for a cached bucket of any version"""
+    if isinstance(value, dict):
+        return value
+    arrays = bucket_arrays(value)
+    if arrays is None:
+        return {}
+    return dict((datetime.fromtimestamp(t, pytz.utc), None if v != v else v)
+                for t, v in zip(arrays[0].tolist(), arrays[1].tolist()))